@@ -3,7 +3,6 @@ import random
 import time
 from decimal import Decimal
 from typing import Dict
-from faker import Faker
 from colorama import Fore, Style
 from vault import Vault
 from utils import generate_random_decimal
@@ -16,11 +15,15 @@ class Action(Enum):
 
 
 class User():
+    __slots__ = ('debug', 'vault', 'name', 'cash', 'usdb', '_actions')
+
     def __init__(self, vault: Vault, name: str, cash: Decimal):
+        self.debug = False
         self.vault = vault
         self.name = name
         self.cash = cash
         self.usdb = Decimal('0')
+        self._actions = (self.nothing, self.mint, self.redeem) # indexed by Action value
 
 
     def nothing(self):
@@ -31,23 +34,28 @@ class User():
         amount = generate_random_decimal(0, self.cash)
         self.cash -= amount
         self.usdb += self.vault.mint(amount)
-        print(f"{Fore.GREEN}{self.name} minted {amount} USDb{Style.RESET_ALL}")
+        if(self.debug):
+            print(f"{Fore.GREEN}{self.name} minted {amount} USDb{Style.RESET_ALL}")
 
 
     def redeem(self):
         amount = generate_random_decimal(0, self.usdb)
-        try:
+        if self.vault.can_redeem(amount):
             self.usdb -= self.vault.redeem(amount)
             self.cash += amount
-            print(f"{Fore.MAGENTA}{self.name} Redeemed {amount} USDb{Style.RESET_ALL}")
-        except:
-            print(f"{Fore.BLACK}{self.name} can't redeem {amount}USDb{Style.RESET_ALL}")
+            if(self.debug):
+                print(f"{Fore.MAGENTA}{self.name} Redeemed {amount} USDb{Style.RESET_ALL}")
+        else:
+            if(self.debug):
+                print(f"{Fore.BLACK}{self.name} can't redeem {amount}USDb{Style.RESET_ALL}")
+
+NAMES = ["alice", "bob", "carol", "dave", "erin", "frank", "grace", "heidi", "ivan", "judy"]
+
 
 def generate_users(n, vault):
-    fake = Faker()
     users = []
-    for _ in range(n):
-        name = fake.user_name()
+    for i in range(n):
+        name = f"{NAMES[i % len(NAMES)]}_{i}"
         amount = generate_random_decimal(1, 1000000)
         user = User(vault, name, amount)
         users.append(user)
@@ -56,24 +64,27 @@ def generate_users(n, vault):
 
 def main():
     print("--------- Starting Bestia Simulator ---------")
-    vault = Vault("Vault", Decimal('0.2'), Decimal('0.05')) # 20% - 5%
-    vault.add_supported_asset("USDe", Decimal('1'), Decimal('0.998'))
-    vault.add_supported_asset("WETH", Decimal('2'), Decimal('3410'))
-    vault.add_supported_asset("WBTC", Decimal('3'), Decimal('64000'))
+    vault = Vault("Vault", Decimal('0.2'), Decimal('0.05'), Decimal('100'), time.monotonic()) # 20% - 5%
+    vault.add_supported_asset("USDe", Decimal('1'), Decimal('0.998'), Decimal('0.2'))
+    vault.add_supported_asset("WETH", Decimal('2'), Decimal('3410'), Decimal('0.5'))
+    vault.add_supported_asset("WBTC", Decimal('3'), Decimal('64000'), Decimal('0.3'))
 
     users = generate_users(10, vault)
+    n_actions = len(Action)
+    asset_names = vault.asset_names()
     try:
         while True:
+            vault.set_time(time.monotonic())
             for user in users:
-                action = random.choice(list(Action))
-                getattr(user, action.name.lower())()
-                vault.rebalance()
-                vault.liquidate()
-
-            random_asset = random.choice(list(vault.assets.keys()))
-            base_ratio = vault.prices[random_asset]
-            lower_bound = base_ratio * Decimal('0.5')
-            upper_bound = base_ratio * Decimal('1.5')
+                user._actions[random.randrange(n_actions)]()
+
+            vault.rebalance()
+            vault.liquidate()
+
+            random_asset = asset_names[random.randrange(len(asset_names))]
+            base_ratio = vault.get_asset_price(random_asset)
+            lower_bound = base_ratio * 0.5
+            upper_bound = base_ratio * 1.5
             new_price = generate_random_decimal(lower_bound, upper_bound)
             vault.set_asset_price(random_asset, new_price)
             print(f"Changed {random_asset} price to {new_price}")
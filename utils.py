@@ -2,4 +2,5 @@ import random
 from decimal import Decimal
 
 def generate_random_decimal(low, high) -> Decimal:
-    return Decimal(str(random.uniform(float(low), float(high)))).quantize(Decimal('0.001'))
+    # round to milli-units as an integer, then shift the exponent: same result as quantize(Decimal('0.001'))
+    return Decimal(round(random.uniform(float(low), float(high)) * 1000)).scaleb(-3)
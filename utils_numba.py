@@ -0,0 +1,27 @@
+import math
+
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional: without it the kernels below run as plain Python functions
+    def njit(*args, **kwargs):
+        return lambda func: func
+
+
+# Normalized swing factor calculation using sigmoid function, fee clamped to 0% - 100%
+@njit(fastmath=True, cache=True)
+def swing_fee(flow: float, price_volatility: float, threshold: float) -> float:
+    a = 0.01  # Scaling factor for flow
+    b = 0.05  # Scaling factor for price volatility
+    c = 0.1   # Exponential growth rate
+    d = 0.02  # Adjustment for deviation
+
+    x = flow * (1 + b * price_volatility)
+    f_x = 1.0 / (1.0 + math.exp(-c * (x - threshold)))
+    final_fee = a * x * (1 + d * f_x)
+
+    if final_fee < 0:
+        return 0.0
+    if final_fee > 1:
+        return 1.0
+    return final_fee
@@ -1,83 +1,154 @@
-import time
-from math import exp
 from decimal import Decimal
+from bisect import insort
 from collections import deque
+import numpy as np
 from colorama import Fore, Style
+from utils_numba import swing_fee
 
 
 # this class stores asset price observations for the price volatility calculations
-class PriceObservation:
-    def __init__(self, timestamp: int, price: Decimal):
-        self.timestamp = timestamp
-        self.price = price
+# as a fixed-size ring buffer, overwriting the oldest observation once full
+class PriceHistory:
+    __slots__ = ('timestamps', 'prices', 'head', 'count')
+
+    def __init__(self, size: int = 1000):
+        self.timestamps = np.empty(size)
+        self.prices = np.empty(size)
+        self.head = 0 # next slot to write
+        self.count = 0 # number of valid observations
+
+
+    def append(self, timestamp: float, price: float):
+        self.timestamps[self.head] = timestamp
+        self.prices[self.head] = price
+        self.head = (self.head + 1) % len(self.prices)
+        if self.count < len(self.prices):
+            self.count += 1
+
+
+    # prices observed at or after min_time, oldest first
+    def since(self, min_time: float) -> np.ndarray:
+        if self.count < len(self.prices):
+            start = np.searchsorted(self.timestamps[:self.count], min_time)
+            return self.prices[start:self.count]
+
+        # once full the buffer holds two sorted runs: older [head:] followed by newer [:head]
+        start = self.head + np.searchsorted(self.timestamps[self.head:], min_time)
+        if start == len(self.prices):
+            start = np.searchsorted(self.timestamps[:self.head], min_time)
+            return self.prices[start:self.head]
+        if self.head == 0:
+            return self.prices[start:]
+        return np.concatenate((self.prices[start:], self.prices[:self.head]))
 
 
 class Vault:
-    def __init__(self, name: str, optimal_cash_threshold: Decimal, liquidation_trigger_threshold: Decimal, window: Decimal):
+    __slots__ = (
+        'debug', 'name', 'cash', 'optimal_cash_threshold', 'liquidation_trigger_threshold', 'token_supply',
+        '_idx', '_holdings', '_liq', '_liquidation_order', '_prices', '_thresholds', '_assets_value',
+        'window', '_now', '_deposits', '_inflow_sum', '_withdrawals', '_outflow_sum', 'price_volatility',
+    )
+
+    def __init__(self, name: str, optimal_cash_threshold: Decimal, liquidation_trigger_threshold: Decimal, window: Decimal, now: float = 0.0):
         self.debug = False
         self.name = name
-        self.cash = 0
-        self.optimal_cash_threshold = optimal_cash_threshold # optimal threshold value after which rebalancing is possible
-        self.liquidation_trigger_threshold = liquidation_trigger_threshold # threshold after which assets become liquidable
-        self.token_supply = Decimal(0)
-        self.assets = {} # balance of each asset in asset amount
-        self.asset_liquidity_value = {} # priority over liquidations
-        self.prices = {}
-        self.window = window # time window for inflow, outflow and volatility calculation
-        self.deposit_requests = {}
-        self.withdrawal_requests = {}
+        self.cash = 0.0
+        self.optimal_cash_threshold = float(optimal_cash_threshold) # optimal threshold value after which rebalancing is possible
+        self.liquidation_trigger_threshold = float(liquidation_trigger_threshold) # threshold after which assets become liquidable
+        self.token_supply = 0.0
+        # per-asset state is kept as parallel float64 arrays, indexed through self._idx
+        self._idx = {} # asset name -> position in the arrays below
+        self._holdings = np.empty(0) # balance of each asset in asset amount
+        self._liq = np.empty(0) # priority over liquidations
+        self._liquidation_order = [] # (liquidity value, index, name) sorted ascending, kept in sync with self._liq
+        self._prices = np.empty(0)
+        self._thresholds = np.empty(0) # asset optimal thresholds
+        self._assets_value = 0.0 # sum of price * holdings, kept up to date on every change
+        self.window = float(window) # time window for inflow, outflow and volatility calculation
+        if self.window <= 0:
+            raise ValueError("Invalid time window")
+        self._now = float(now) # vault clock, advanced by set_time
+        self._deposits = deque() # (timestamp, amount) of mints, oldest first
+        self._inflow_sum = 0.0 # sum of the amounts still in self._deposits
+        self._withdrawals = deque() # (timestamp, amount) of redeems, oldest first
+        self._outflow_sum = 0.0 # sum of the amounts still in self._withdrawals
         self.price_volatility = {} # storing price observations
-        self.thresholds = {} # asset optimal thresholds
+
+
+    # names of the supported assets, in the order they were added
+    def asset_names(self) -> list:
+        return list(self._idx)
+
+
+    # advance the vault clock. It is the only clock the vault uses: every timestamp and time window
+    # is measured against it, and it must never go backwards since the request and price histories are kept in time order
+    def set_time(self, now: float):
+        if now < self._now:
+            raise ValueError("Time can't go backwards")
+        self._now = now
 
 
     # provide cash and get bestia
     def mint(self, amount: Decimal) -> Decimal:
-        self.cash += amount
-        self.token_supply += amount
-        self.deposit_requests[time.time()] = amount
+        value = float(amount)
+        self.cash += value
+        self.token_supply += value
+        self._deposits.append((self._now, value))
+        self._inflow_sum += value
+        self._inflow_sum = self._expire(self._deposits, self._inflow_sum)
         return amount
 
 
+    # whether the vault holds enough cash to redeem amount
+    def can_redeem(self, amount: Decimal) -> bool:
+        return self.cash >= float(amount)
+
+
     # give bestia and get cash
     def redeem(self, amount: Decimal) -> Decimal:
-        if self.cash < amount:
+        value = float(amount)
+        if self.cash < value:
             raise ValueError("Not enough cash")
 
-        self.cash -= amount
-        self.token_supply -= amount
-        self.withdrawal_requests[time.time()] = amount
+        self.cash -= value
+        self.token_supply -= value
+        self._withdrawals.append((self._now, value))
+        self._outflow_sum += value
+        self._outflow_sum = self._expire(self._withdrawals, self._outflow_sum)
         return amount
 
     
     # whitelist an asset held by the vault
     def add_supported_asset(self, name: str, liquidity_value: Decimal, price: Decimal, threshold: Decimal):
-        if name in self.assets:
+        if name in self._idx:
             raise ValueError("Name already present")
         
-        if threshold > Decimal(100):
+        if threshold > 100:
             raise ValueError("Invalid threshold")
 
-        self.assets[name] = Decimal(0)
-        self.asset_liquidity_value[name] = liquidity_value
-        self.price_volatility[name] = deque(maxlen=1000) # Limit the size to last 1000 observations
-        self.price_volatility[name].append(PriceObservation(time.time(), price))
-        self.prices[name] = price
-        self.thresholds[name] = threshold
+        self._idx[name] = len(self._idx)
+        self._holdings = np.append(self._holdings, 0.0)
+        self._liq = np.append(self._liq, float(liquidity_value))
+        insort(self._liquidation_order, (float(liquidity_value), self._idx[name], name))
+        self._prices = np.append(self._prices, float(price))
+        self._thresholds = np.append(self._thresholds, float(threshold))
+        self.price_volatility[name] = PriceHistory(1000) # Limit the size to last 1000 observations
+        self.price_volatility[name].append(self._now, float(price))
 
 
     def change_asset_threshold(self, asset: str, threshold: Decimal):
-        if asset not in self.assets:
+        if asset not in self._idx:
             raise ValueError("Asset not present")
 
-        if threshold > Decimal(100):
+        if threshold > 100:
             raise ValueError("Invalid threshold")
 
-        self.thresholds[asset] = threshold
+        self._thresholds[self._idx[asset]] = float(threshold)
 
 
     # TBD
     # defines the added pricing when redeeming directly an asset
-    def swing_pricing(self, asset: str, inflow: bool) -> Decimal:
+    def swing_pricing(self, asset: str, inflow: bool) -> float:
         if (inflow):
             flow = self.get_inflow()
         else:
@@ -86,55 +157,36 @@ class Vault:
         price_volatility = self.get_price_volatility(asset)
         threshold = self.get_current_asset_threshold(asset)
 
-        # Coefficients
-        a = Decimal('0.01')  # Scaling factor for flow
-        b = Decimal('0.05')  # Scaling factor for price volatility
-        c = Decimal('0.1')   # Exponential growth rate
-        d = Decimal('0.02')  # Adjustment for deviation
-
-        # Normalized swing factor calculation using sigmoid function
-        x = flow * (1 + b * price_volatility)
-        f_x = Decimal(1) / (Decimal(1) + Decimal(exp(-float(c * (x - threshold)))))
-
-        # Final fee adjustment
-        final_fee = a * x * (1 + d * f_x)
-
-        # Ensure the fee is within 0% to 100%
-        final_fee_normalized = max(0, min(1, final_fee))
-
-        return final_fee_normalized
+        return swing_fee(flow, price_volatility, threshold)
 
     # use extra cash to buy assets
     def rebalance(self):
         # First, check if rebalancing is necessary
-        current_cash_ratio = self.get_current_cash_threshold()
-        if current_cash_ratio <= self.optimal_cash_threshold:
+        if not self._idx:
+            return # no assets to buy
+
+        total_value = self.get_total_value()
+        if total_value == 0 or self.cash / total_value <= self.optimal_cash_threshold:
             return
 
         # Calculate the excess cash that needs to be converted into assets
-        total_value = self.get_total_value()
         desired_cash = self.optimal_cash_threshold * total_value
         excess_cash = self.cash - desired_cash
 
         if(self.debug):
             print(f"{Fore.BLUE}Cash to rebalance: {excess_cash}{Style.RESET_ALL}")
 
-        # Distribute the excess cash among assets based on their liquidity value
-        for asset in self.assets:
-            if self.prices.get(asset, 0) == 0:
-                raise ValueError(f"Invalid asset price for {asset}")
-            
-            # Calculate how much cash to allocate to this asset based on its liquidity share
-            cash_for_asset =  excess_cash  / Decimal(self.assets.__len__())
-
-            # Determine how many units of the asset to buy
-            price_per_unit = self.prices[asset]
-            quantity_to_buy = cash_for_asset / price_per_unit
+        if not self._prices.all():
+            asset = next(name for name, i in self._idx.items() if self._prices[i] == 0)
+            raise ValueError(f"Invalid asset price for {asset}")
 
-            # Update asset holdings
-            self.assets[asset] += quantity_to_buy
-            if(self.debug):
-                print(f"{Fore.BLUE}Buying {quantity_to_buy} {asset}{Style.RESET_ALL}")
+        # Distribute the excess cash evenly among assets and buy the matching quantities
+        quantity_to_buy = (excess_cash / len(self._idx)) / self._prices
+        self._holdings += quantity_to_buy
+        self._assets_value += excess_cash
+        if(self.debug):
+            for asset, i in self._idx.items():
+                print(f"{Fore.BLUE}Buying {quantity_to_buy[i]} {asset}{Style.RESET_ALL}")
 
         # Update cash holdings after rebalancing
         self.cash -= excess_cash
@@ -143,125 +195,120 @@ class Vault:
 
 
     def set_asset_price(self, asset: str, price: Decimal):
-        self.price_volatility[asset] = deque(maxlen=1000)
-        self.price_volatility[asset].append(PriceObservation(time.time(), price))
-        self.prices[asset] = price
+        price = float(price)
+        i = self._idx[asset]
+        self.price_volatility[asset].append(self._now, price) # the ring buffer evicts the oldest observation
+        self._assets_value += (price - float(self._prices[i])) * float(self._holdings[i])
+        self._prices[i] = price
 
     
     def set_asset_liquidity_value(self, asset: str, value: Decimal):
-        self.asset_liquidity_value[asset] = value
+        i = self._idx[asset]
+        self._liquidation_order.remove((float(self._liq[i]), i, asset))
+        self._liq[i] = float(value)
+        insort(self._liquidation_order, (float(value), i, asset))
 
     
-    # value of a single asset in cash terms
-    def get_asset_value(self, asset: str) -> Decimal:
-        if asset not in self.assets:
+    def get_asset_price(self, asset: str) -> float:
+        if asset not in self._idx:
             raise ValueError("Invalid asset")
 
-        if asset not in self.prices:
-            raise ValueError("Invalid price")
-        
-        return self.prices[asset] * self.assets[asset]
+        return float(self._prices[self._idx[asset]])
 
 
-    # value of all assets in cash terms
-    def get_assets_value(self) -> Decimal:
-        total = Decimal('0')
-        for key, value in self.assets.items():
-            total += self.get_asset_value(key)
-        return total
+    # value of a single asset in cash terms
+    def get_asset_value(self, asset: str) -> float:
+        if asset not in self._idx:
+            raise ValueError("Invalid asset")
 
+        i = self._idx[asset]
+        return float(self._prices[i] * self._holdings[i])
 
-    def get_inflow(self) -> Decimal:
-        total = Decimal(0)
-        min_time = Decimal(time.time()) - self.window
-        if self.window == 0 or min_time < 0:
-            raise ValueError("Invalid time window")
 
-        for key, value in self.deposit_requests.items():
-            if (key < min_time):
-                pass
-            else:
-                total += value
+    # value of all assets in cash terms
+    def get_assets_value(self) -> float:
+        return self._assets_value
 
-        return total / self.window
 
+    # drop requests older than the window from the left of requests, returning their running sum without them
+    def _expire(self, requests: deque, total: float) -> float:
+        min_time = self._now - self.window
 
-    def get_outflow(self) -> Decimal:
-        total = Decimal(0)
-        min_time = Decimal(time.time()) - self.window
-        if self.window == 0 or min_time < 0:
-            raise ValueError("Invalid time window")
+        # requests are appended in time order, so expired ones sit at the left end
+        while requests and requests[0][0] < min_time:
+            total -= requests.popleft()[1]
+        if not requests:
+            total = 0.0 # drop accumulated rounding error
+        return total
 
-        for key, value in self.withdrawal_requests.items():
-            if (key < min_time):
-                pass
-            else:
-                total += value
 
-        return total / self.window
+    def get_inflow(self) -> float:
+        self._inflow_sum = self._expire(self._deposits, self._inflow_sum)
+        return self._inflow_sum / self.window
+
 
+    def get_outflow(self) -> float:
+        self._outflow_sum = self._expire(self._withdrawals, self._outflow_sum)
+        return self._outflow_sum / self.window
 
-    def get_price_volatility(self, asset: str) -> Decimal:
-        current_time = Decimal(time.time())
-        min_time = current_time - self.window
-        relevant_prices = []
 
-        for item in self.price_volatility[asset]:
-            if item.timestamp >= min_time:
-                relevant_prices.append(item.price)
+    def get_price_volatility(self, asset: str) -> float:
+        relevant_prices = self.price_volatility[asset].since(self._now - self.window)
         
         if len(relevant_prices) < 2:
-            return Decimal('0')
+            return 0.0
 
-        mean_price = sum(relevant_prices) / Decimal(len(relevant_prices))
-        variance = sum((price - mean_price) ** 2 for price in relevant_prices) / Decimal(len(relevant_prices))
-        return variance.sqrt()
+        return float(relevant_prices.std())
 
 
-    def get_current_asset_threshold(self, asset: str) -> Decimal:
-        if asset not in self.thresholds:
+    def get_current_asset_threshold(self, asset: str) -> float:
+        if asset not in self._idx:
             raise ValueError("Invalid asset")
         
-        if self.get_assets_value() == 0 or self.get_asset_value(asset) == 0:
-            return Decimal(0)
+        assets_value = self.get_assets_value()
+        asset_value = self.get_asset_value(asset)
+        if assets_value == 0 or asset_value == 0:
+            return 0.0
         
-        asset_threshold = self.get_asset_value(asset) / self.get_assets_value()
+        asset_threshold = asset_value / assets_value
 
-        return abs(self.thresholds[asset] - asset_threshold)
+        return abs(float(self._thresholds[self._idx[asset]]) - asset_threshold)
 
 
-    def get_total_value(self) -> Decimal:
+    def get_total_value(self) -> float:
         return self.get_assets_value() + self.cash
 
 
 ### user-driven liquidations ###
-    def liquidate_asset(self, asset: str, amount: Decimal) -> Decimal:
-        if asset not in self.assets:
+    def liquidate_asset(self, asset: str, amount: Decimal) -> float:
+        if asset not in self._idx:
             raise ValueError("Asset not supported")
         
-        if asset not in self.prices:
-            raise ValueError("Invalid price")
-        
-        if self.assets[asset] < amount:
+        i = self._idx[asset]
+        amount = float(amount)
+        if self._holdings[i] < amount:
             raise ValueError("Not enough asset amount")
 
-        asset_value = amount * self.prices[asset]
+        asset_value = amount * float(self._prices[i])
         if self.cash >= asset_value:
             raise ValueError("No need to liquidate asset, enough cash available")
 
-        swing_pricing_factor = self.swing_pricing(asset, amount, False)
+        swing_pricing_factor = self.swing_pricing(asset, False)
         user_part = asset_value * (1 - swing_pricing_factor)
         protocol_part = asset_value - user_part
 
         if (self.debug):
             print(f"{Fore.BLUE}Liquidated {amount} {asset}, user got {user_part} and protocol got {protocol_part} with a swing pricing factor of {swing_pricing_factor}{Style.RESET_ALL}")
 
+        return user_part
+
 
 ### protocol-driven liquidations ###
-    def get_current_cash_threshold(self) -> Decimal:
-        if self.get_total_value() == 0:
-            return Decimal(0)
-        return self.cash / self.get_total_value()
+    def get_current_cash_threshold(self) -> float:
+        total_value = self.get_total_value()
+        if total_value == 0:
+            return 0.0
+        return self.cash / total_value
 
 
     def is_liquidable(self) -> bool:
@@ -275,56 +322,50 @@ class Vault:
         # Calculate the amount needed to restore the threshold
         total_value = self.get_total_value()
         desired_cash = self.optimal_cash_threshold * total_value
-        required_cash = desired_cash - self.cash
+        remaining_cash = desired_cash - self.cash # still to raise, decremented as assets are sold
 
         if(self.debug):
-            print(f"{Fore.RED}Need to raise: {required_cash} to restore threshold{Style.RESET_ALL}")
+            print(f"{Fore.RED}Need to raise: {remaining_cash} to restore threshold{Style.RESET_ALL}")
 
-        # Sort assets by liquidity value in descending order
-        sorted_assets = sorted(self.asset_liquidity_value.items(), key=lambda item: item[1], reverse=False)
-
-        # Attempt to liquidate assets until the required cash amount is raised or assets are exhausted
-        for asset, _ in sorted_assets:
-            if self.cash >= required_cash:
+        # Attempt to liquidate assets, lowest liquidity value first, until the required cash amount is raised or assets are exhausted
+        for _, i, asset in self._liquidation_order:
+            if remaining_cash <= 0:
                 break
 
             # Check the current holdings and price of the asset
-            current_holdings = self.assets.get(asset, 0)
+            current_holdings = float(self._holdings[i])
             if current_holdings == 0:
                 continue  # Skip if no holdings
 
-            asset_price = self.prices.get(asset, 0)
+            asset_price = float(self._prices[i])
             if asset_price == 0:
                 raise ValueError(f"Invalid asset price for {asset}")
 
             # Calculate the maximum cash that could be obtained by liquidating this asset
             max_cash_obtainable = current_holdings * asset_price
 
-            # Calculate the still required cash to reach the desired threshold
-            still_required_cash = desired_cash - self.cash
-
             # Determine how much of the asset to liquidate
-            if max_cash_obtainable + self.cash < desired_cash:
+            if max_cash_obtainable < remaining_cash:
                 # Liquidate all holdings of this asset
                 self.cash += max_cash_obtainable
-                self.assets[asset] = 0
+                self._holdings[i] = 0.0
+                self._assets_value -= max_cash_obtainable
+                remaining_cash -= max_cash_obtainable
                 if(self.debug):
                     print(f"{Fore.RED}Liquidated all of {asset}, raised {max_cash_obtainable}{Style.RESET_ALL}")
             else:
                 # Calculate exact amount of the asset to liquidate to meet the requirement
-                quantity_to_sell = still_required_cash / asset_price
-                self.assets[asset] -= quantity_to_sell
+                quantity_to_sell = remaining_cash / asset_price
+                self._holdings[i] -= quantity_to_sell
                 actual_cash_raised = quantity_to_sell * asset_price
                 self.cash += actual_cash_raised
+                self._assets_value -= actual_cash_raised
+                remaining_cash = 0.0 # this sale covers the rest, avoid leaving float dust to liquidate
                 if(self.debug):
                     print(f"{Fore.RED}Liquidated {quantity_to_sell} of {asset}, raised {actual_cash_raised}{Style.RESET_ALL}")
-        
-        # Update the total value and required cash after each liquidation
-        total_value = self.get_total_value()
-        desired_cash = self.optimal_cash_threshold * total_value
 
         if(self.debug):
-            if self.cash >= required_cash:
+            if remaining_cash <= 0:
                 print(f"{Fore.RED}Threshold successfully restored{Style.RESET_ALL}")
             else:
                 print(f"{Fore.RED}Unable to restore threshold, all liquid assets exhausted{Style.RESET_ALL}")
@@ -335,8 +376,8 @@ class Vault:
         print("| VAULT STATUS")
         print("| Vault: ", self.name)
         print("| Assets")
-        for key, value in self.assets.items():
-            print("| * " + key + ": ", value)
+        for key, i in self._idx.items():
+            print("| * " + key + ": ", self._holdings[i])
         print("| Value: ", self.get_assets_value())
         print("| Cash: ", self.cash)
         print("| Current cash threshold: ", self.get_current_cash_threshold() * 100)
@@ -344,17 +385,18 @@ class Vault:
         print("-------------------------------------")
 
 
-vault = Vault("Base", Decimal('0.2'), Decimal('0.05'), Decimal('100')) # 20% - 5%
-vault.add_supported_asset("USDe", Decimal('1'), Decimal('0.998'), Decimal('0.2'))
-vault.add_supported_asset("WETH", Decimal('2'), Decimal('3410'), Decimal('0.5'))
-vault.add_supported_asset("WBTC", Decimal('3'), Decimal('64000'), Decimal('0.3'))
-vault.print_status()
-vault.mint(Decimal('10000'))
-vault.rebalance()
-vault.print_status()
-vault.redeem(Decimal('2000'))
-vault.liquidate()
-vault.redeem(Decimal('1500'))
-vault.liquidate()
-vault.print_status()
-print(vault.swing_pricing("WBTC", False))
+if __name__ == "__main__":
+    vault = Vault("Base", Decimal('0.2'), Decimal('0.05'), Decimal('100')) # 20% - 5%
+    vault.add_supported_asset("USDe", Decimal('1'), Decimal('0.998'), Decimal('0.2'))
+    vault.add_supported_asset("WETH", Decimal('2'), Decimal('3410'), Decimal('0.5'))
+    vault.add_supported_asset("WBTC", Decimal('3'), Decimal('64000'), Decimal('0.3'))
+    vault.print_status()
+    vault.mint(Decimal('10000'))
+    vault.rebalance()
+    vault.print_status()
+    vault.redeem(Decimal('2000'))
+    vault.liquidate()
+    vault.redeem(Decimal('1500'))
+    vault.liquidate()
+    vault.print_status()
+    print(vault.swing_pricing("WBTC", False))